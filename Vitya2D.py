@@ -1,8 +1,10 @@
+import math
 import numpy as np
 import matplotlib.pyplot as plt
 from matplotlib.animation import FuncAnimation
+from matplotlib.collections import LineCollection
+from matplotlib.colors import to_rgba
 from matplotlib.widgets import Button, RadioButtons
-import heapq
 
 # Shape configurations
 def get_dog_shape():
@@ -19,7 +21,7 @@ def get_dog_shape():
 
 def get_snake_shape():
     return {
-        'positions': {i + 1: [i, 5 + np.sin(i * 0.5)] for i in range(12)},
+        'positions': {i + 1: [i, 5 + math.sin(i * 0.5)] for i in range(12)},
         'connections': [(i, i + 1) for i in range(1, 12)],
         'center': 12,
         'type': 'snake'
@@ -35,6 +37,20 @@ def get_line_shape():
 
 # Globals
 obstacle_types = {'High Wall': 'red', 'Tunnel Wall': 'blue', 'Low Wall': 'yellow'}
+obstacle_codes = {'High Wall': 1, 'Tunnel Wall': 2, 'Low Wall': 3}
+code_types = [None, 'High Wall', 'Tunnel Wall', 'Low Wall']
+# Which obstacle codes block each shape, indexed by code (0 = empty)
+blocking_lut = {
+    'dog': np.array([False, True, True, False]),
+    'snake': np.array([False, True, False, True]),
+    'line': np.array([False, True, True, True]),
+}
+# Which obstacle codes near the center make each shape transform
+shroud_lut = {
+    'dog': np.array([False, False, True, False]),
+    'snake': np.array([False, False, False, True]),
+    'line': np.array([False, False, True, True]),
+}
 current_obstacle_type = 'High Wall'
 current_shape_type = 'dog'
 current_shape = get_dog_shape()
@@ -42,14 +58,33 @@ current_shape = get_dog_shape()
 initial_positions = current_shape['positions']
 connections = current_shape['connections']
 center_id = current_shape['center']
-positions = {k: np.array(v, dtype=float) for k, v in initial_positions.items()}
+
+def shape_offsets(points, center):
+    return np.stack([np.asarray(points[k], dtype=float) - np.asarray(points[center], dtype=float)
+                     for k in points])
+
+# Dot positions live in one (N, 2) array; id_to_row maps dot ids to rows
+def shape_arrays(points, links):
+    id_to_row = {k: i for i, k in enumerate(points)}
+    pos_arr = np.array([points[k] for k in points], dtype=np.float32)
+    conn_idx = np.array([(id_to_row[a], id_to_row[b]) for a, b in links], dtype=np.int32)
+    return id_to_row, pos_arr, conn_idx
+
+relative_offsets_arr = shape_offsets(initial_positions, center_id)
+id_to_row, pos_arr, conn_idx = shape_arrays(initial_positions, connections)
+center_row = id_to_row[center_id]
 
 grid_size = (40, 40)
 obstacles = {}
+obs_grid = np.zeros(grid_size, dtype=np.uint8)
+obstacles_version = 0
 path = []
 step_index = 0
 safety_margin = 1
-expanded_obstacles = set()
+blocked_mask = np.zeros(grid_size, dtype=bool)
+# (shape type, safety margin, obstacles version) -> (blocked_mask, free list).
+# The free mask is stored as nested lists, the form astar_search reads.
+mask_cache = {}
 
 # Matplotlib setup
 fig, ax = plt.subplots()
@@ -58,8 +93,14 @@ ax.set_xlim(0, 40)
 ax.set_ylim(0, 40)
 ax.grid(True)
 dots, = ax.plot([], [], 'o', color='blue')
-lines = [ax.plot([], [], 'k-', linewidth=2)[0] for _ in connections]
-obstacle_patches = []
+line_segments = ax.add_collection(LineCollection([], colors='k', linewidths=2))
+# Obstacles and their margins are one RGBA texture, CELL_PX pixels per cell.
+# It is part of the static background, not a blitted artist.
+CELL_PX = 8
+obs_img = ax.imshow(np.zeros((grid_size[1] * CELL_PX, grid_size[0] * CELL_PX, 4)),
+                    extent=(0, grid_size[0], 0, grid_size[1]), origin='lower',
+                    interpolation='nearest', zorder=0, animated=False)
+obstacles_dirty = True
 goal_marker, = ax.plot([], [], 'gx', markersize=12, label='Goal')
 
 # UI Buttons
@@ -84,177 +125,272 @@ axradio = plt.axes([0.75, 0.6, 0.15, 0.2])
 radio_btn = RadioButtons(axradio, list(obstacle_types.keys()))
 radio_btn.on_clicked(set_obstacle_type)
 
-# Heuristic
+# Rectangle dilation of a boolean grid by shifted ORs, one axis at a time:
+# out[x, y] is set if mask[x + dx, y + dy] is set for some dx in dxs, dy in dys
+def dilate(mask, dxs, dys):
+    W, H = mask.shape
+    rows = np.zeros_like(mask)
+    for dx in dxs:
+        rows[max(-dx, 0):W + min(-dx, 0)] |= mask[max(dx, 0):W + min(dx, 0)]
+    out = np.zeros_like(mask)
+    for dy in dys:
+        out[:, max(-dy, 0):H + min(-dy, 0)] |= rows[:, max(dy, 0):H + min(dy, 0)]
+    return out
+
+# 8-connected moves with integer step costs. 99 / 70 overshoots sqrt(2) by about
+# 7.2e-5 (5.1e-5 relative). On the 40x40 grid this never reorders path costs:
+# two paths can only tie if they trade 70 diagonal moves for 99 straight ones,
+# which does not fit. Recheck before growing grid_size.
+STEP_COST = 70
+DIAG_COST = 99
+DIRS = ((-1, 0, STEP_COST), (1, 0, STEP_COST), (0, -1, STEP_COST), (0, 1, STEP_COST),
+        (-1, -1, DIAG_COST), (-1, 1, DIAG_COST), (1, -1, DIAG_COST), (1, 1, DIAG_COST))
+
+# Octile distance heuristic, in the same integer units
 def heuristic(a, b):
-    return np.hypot(a[0] - b[0], a[1] - b[1])
-
-# A* with full-body check
-def a_star(start, goal, obstacles, grid_size):
-    directions = [(-1,0), (1,0), (0,-1), (0,1), (-1,-1), (-1,1), (1,-1), (1,1)]
-    frontier = [(0, start)]
-    came_from = {start: None}
-    cost_so_far = {start: 0}
-
-    def is_blocked(cell):
-        otype = obstacles.get(cell)
-        if current_shape_type == 'line':
-            return otype is not None
-        if otype == 'High Wall':
-            return True
-        if current_shape_type == 'dog' and otype == 'Tunnel Wall':
-            return True
-        if current_shape_type == 'snake' and otype == 'Low Wall':
-            return True
-        return False
-
-    expanded_obstacles.clear()
-    for ox, oy in obstacles:
-        if is_blocked((ox, oy)):
-            for dx in range(-safety_margin, safety_margin + 1):
-                for dy in range(-safety_margin, safety_margin + 1):
-                    nx, ny = ox + dx, oy + dy
-                    if 0 <= nx < grid_size[0] and 0 <= ny < grid_size[1]:
-                        expanded_obstacles.add((nx, ny))
-
-    relative_offsets = {
-        k: np.array(initial_positions[k]) - np.array(initial_positions[center_id])
-        for k in initial_positions
-    }
+    dx = abs(a[0] - b[0])
+    dy = abs(a[1] - b[1])
+    return STEP_COST * (dx + dy) + (DIAG_COST - 2 * STEP_COST) * min(dx, dy)
+
+# Full-body check for every center cell at once: free_mask[x, y] is True when
+# each dot of the shape centered at (x, y) rounds to an on-grid, unblocked cell.
+# Rounding a dot depends on x and y separately, so each offset is one
+# outer-product lookup into blocked_mask.
+def footprint_free_mask(blocked_mask, offsets):
+    W, H = blocked_mask.shape
+    free = np.ones((W, H), dtype=bool)
+    for ox, oy in offsets:
+        xs = np.rint(np.arange(W) + ox).astype(np.intp)
+        ys = np.rint(np.arange(H) + oy).astype(np.intp)
+        x_in, y_in = (xs >= 0) & (xs < W), (ys >= 0) & (ys < H)
+        free &= x_in[:, None] & y_in[None, :]
+        free &= ~blocked_mask[np.clip(xs, 0, W - 1)[:, None], np.clip(ys, 0, H - 1)[None, :]]
+    return free
 
-    def is_valid_position(center):
-        for offset in relative_offsets.values():
-            dot_pos = center + offset
-            cx, cy = int(round(dot_pos[0])), int(round(dot_pos[1]))
-            if not (0 <= cx < grid_size[0] and 0 <= cy < grid_size[1]):
-                return False
-            if (cx, cy) in expanded_obstacles:
-                return False
-        return True
-
-    while frontier:
-        _, current = heapq.heappop(frontier)
-        if current == goal:
+# Per-cell search state, reused across searches. A cell's g and parent are
+# only meaningful when seen[idx] equals the current search_id, and it is
+# expanded when closed[idx] does, so nothing is cleared between searches.
+search_id = 0
+search_seen = []
+search_closed = []
+search_g = []
+search_parent = []
+
+# A* over a full-body validity mask given as nested lists, free[x][y].
+# Cells are addressed by flat index idx = y * W + x.
+def astar_search(free, start, goal):
+    global search_id
+    W, H = len(free), len(free[0])
+    if not (0 <= goal[0] < W and 0 <= goal[1] < H):
+        return []
+    if len(search_seen) != W * H:
+        search_seen[:] = [0] * (W * H)
+        search_closed[:] = [0] * (W * H)
+        search_g[:] = [0] * (W * H)
+        search_parent[:] = [-1] * (W * H)
+    search_id += 1
+    sid = search_id
+    seen, closed, g, parent = search_seen, search_closed, search_g, search_parent
+
+    start_idx = start[1] * W + start[0]
+    goal_idx = goal[1] * W + goal[0]
+    seen[start_idx] = sid
+    g[start_idx] = 0
+    parent[start_idx] = -1
+
+    # Bucket queue keyed by integer f. With a consistent heuristic no push
+    # lands below the current f, so only an emptied bucket needs a min() over
+    # the live keys. Popping from the end of a bucket favours the most
+    # recently pushed, deeper nodes among equal f.
+    f = heuristic(goal, start)
+    buckets = {f: [start_idx]}
+    found = False
+    while buckets:
+        bucket = buckets[f]
+        if not bucket:
+            del buckets[f]
+            if buckets:
+                f = min(buckets)
+            continue
+        idx = bucket.pop()
+        if idx == goal_idx:
+            found = True
             break
-        for dx, dy in directions:
-            neighbor = (current[0] + dx, current[1] + dy)
-            if not (0 <= neighbor[0] < grid_size[0] and 0 <= neighbor[1] < grid_size[1]):
-                continue
-            if not is_valid_position(np.array(neighbor, dtype=float)):
+        if closed[idx] == sid:
+            continue  # stale entry, already expanded from a lower f
+        closed[idx] = sid
+        cost = g[idx]
+        cx, cy = idx % W, idx // W
+        for dx, dy, step in DIRS:
+            nx, ny = cx + dx, cy + dy
+            if not (0 <= nx < W and 0 <= ny < H) or not free[nx][ny]:
                 continue
-            new_cost = cost_so_far[current] + np.hypot(dx, dy)
-            if neighbor not in cost_so_far or new_cost < cost_so_far[neighbor]:
-                cost_so_far[neighbor] = new_cost
-                priority = new_cost + heuristic(goal, neighbor)
-                heapq.heappush(frontier, (priority, neighbor))
-                came_from[neighbor] = current
+            n_idx = ny * W + nx
+            new_cost = cost + step
+            if seen[n_idx] != sid or new_cost < g[n_idx]:
+                seen[n_idx] = sid
+                g[n_idx] = new_cost
+                buckets.setdefault(new_cost + heuristic(goal, (nx, ny)), []).append(n_idx)
+                parent[n_idx] = idx
 
     path = []
-    curr = goal
-    while curr and curr in came_from:
-        path.append(np.array(curr, dtype=float))
-        curr = came_from[curr]
+    if not found:
+        return path
+    idx = goal_idx
+    while idx != -1:
+        path.append(np.array((idx % W, idx // W), dtype=float))
+        idx = parent[idx]
     path.reverse()
     return path
 
+# A* with full-body check against the global obs_grid. Masks are cached per
+# obstacles_version, which only toggle_obstacle changes.
+def a_star(start, goal):
+    global blocked_mask
+    key = (current_shape_type, safety_margin, obstacles_version)
+    if key not in mask_cache:
+        raw = blocking_lut[current_shape_type][obs_grid]
+        margin = range(-safety_margin, safety_margin + 1)
+        blocked = dilate(raw, margin, margin)
+        mask_cache[key] = blocked, footprint_free_mask(blocked, relative_offsets_arr).tolist()
+    blocked_mask, free = mask_cache[key]
+    return astar_search(free, start, goal)
+
+# Obstacle edits keep the dict and the code grid in sync
+def toggle_obstacle(cell, otype):
+    global obstacles_dirty, obstacles_version
+    if cell in obstacles:
+        del obstacles[cell]
+        code = 0
+    else:
+        obstacles[cell] = otype
+        code = obstacle_codes[otype]
+    obstacles_dirty = True
+    if 0 <= cell[0] < grid_size[0] and 0 <= cell[1] < grid_size[1]:
+        obs_grid[cell] = code
+    # Masks for older versions can never be hit again
+    obstacles_version += 1
+    mask_cache.clear()
+
 # Robot updates
 def update_positions():
-    global positions, path, step_index
+    global path, step_index
     if not path or step_index >= len(path): return
     next_pos = path[step_index]
     step_index += 1
-    delta = next_pos - positions[center_id]
-    for k in positions:
-        offset = np.array(initial_positions[k]) - np.array(initial_positions[center_id])
-        positions[k] = next_pos + offset
-
-    cx, cy = map(int, positions[center_id])
-    for dx in range(-safety_margin, safety_margin + 1):
-        for dy in range(-safety_margin, safety_margin + 1):
-            nx, ny = cx + dx, cy + dy
-            if (nx, ny) in obstacles:
-                otype = obstacles[(nx, ny)]
-                if otype == 'Tunnel Wall' and current_shape_type != 'snake':
-                    print('Shroud: switching to snake')
-                    switch_shape(get_snake_shape())
-                    return
-                elif otype == 'Low Wall' and current_shape_type != 'dog':
-                    print('Shroud: switching to dog')
-                    switch_shape(get_dog_shape())
-                    return
+    pos_arr[:] = next_pos + relative_offsets_arr
+
+    # Window is flattened in (dx, dy) scan order, so hits[0] is the first trigger
+    cx, cy = int(next_pos[0]), int(next_pos[1])
+    window = obs_grid[max(cx - safety_margin, 0):cx + safety_margin + 1,
+                      max(cy - safety_margin, 0):cy + safety_margin + 1].ravel()
+    hits = window[shroud_lut[current_shape_type][window]]
+    if hits.size == 0:
+        return
+    if code_types[hits[0]] == 'Tunnel Wall':
+        print('Shroud: switching to snake')
+        switch_shape(get_snake_shape())
+    else:
+        print('Shroud: switching to dog')
+        switch_shape(get_dog_shape())
 
 # Visualization
+# For each cell, the code of the first obstacle met when scanning
+# (dx, dy) over [-radius, radius]^2 in row order, or 0 if there is none.
+# Shifts are applied last-to-first so earlier ones overwrite later ones.
+def nearest_obstacle_codes(obs_grid, radius):
+    W, H = obs_grid.shape
+    nearest = np.zeros_like(obs_grid)
+    for dx in range(radius, -radius - 1, -1):
+        for dy in range(radius, -radius - 1, -1):
+            shifted = np.zeros_like(obs_grid)
+            shifted[max(-dx, 0):W + min(-dx, 0), max(-dy, 0):H + min(-dy, 0)] = \
+                obs_grid[max(dx, 0):W + min(dx, 0), max(dy, 0):H + min(dy, 0)]
+            nearest = np.where(shifted > 0, shifted, nearest)
+    return nearest
+
+# Colour tables indexed by obstacle code
+fill_lut = np.array([to_rgba('none')] + [to_rgba(obstacle_types[t]) for t in code_types[1:]])
+margin_lut = np.array([to_rgba('pink', 0.3)] + [to_rgba(obstacle_types[t], 0.3) for t in code_types[1:]])
+edge_lut = np.array([to_rgba('none'), to_rgba('none'), to_rgba('cyan', 0.6), to_rgba('orange', 0.6)])
+
+# Dashed border inside one cell's block of pixels
+_dash = (np.arange(CELL_PX) // 2) % 2 == 0
+outline_tile = np.zeros((CELL_PX, CELL_PX), dtype=bool)
+outline_tile[[0, -1], :] = _dash
+outline_tile[:, [0, -1]] |= _dash[:, None]
+
+def obstacle_rgba():
+    cells = np.zeros(obs_grid.shape + (4,))
+    nearest = nearest_obstacle_codes(obs_grid, safety_margin)
+    margin = blocked_mask & (obs_grid == 0)
+    cells[margin] = margin_lut[nearest[margin]]
+    cells[obs_grid > 0] = fill_lut[obs_grid[obs_grid > 0]]
+    img = cells.repeat(CELL_PX, axis=0).repeat(CELL_PX, axis=1)
+
+    # Composite dashed outlines over tunnel/low-wall margins
+    outlined = np.kron(margin & (nearest >= 2), outline_tile).astype(bool)
+    edge = edge_lut[nearest].repeat(CELL_PX, axis=0).repeat(CELL_PX, axis=1)[outlined]
+    under = img[outlined]
+    alpha = edge[:, 3:] + under[:, 3:] * (1 - edge[:, 3:])
+    rgb = (edge[:, :3] * edge[:, 3:] + under[:, :3] * under[:, 3:] * (1 - edge[:, 3:])) / alpha
+    img[outlined] = np.hstack([rgb, alpha])
+    return img.transpose(1, 0, 2)
+
+# Redraw the background once and, when blitting, drop the animation's cached
+# copy of it so the next frame picks up the new obstacles. FuncAnimation has
+# no public way to invalidate that cache; _blit is False and _blit_cache does
+# not exist on canvases without blit support.
 def draw_obstacles():
-    for patch in obstacle_patches:
-        patch.remove()
-    obstacle_patches.clear()
-    for (ox, oy), otype in obstacles.items():
-        rect = plt.Rectangle((ox, oy), 1, 1, color=obstacle_types[otype])
-        ax.add_patch(rect)
-        obstacle_patches.append(rect)
-    for ox, oy in expanded_obstacles:
-        if (ox, oy) not in obstacles:
-            nearest_type = None
-            for dx in range(-safety_margin, safety_margin + 1):
-                for dy in range(-safety_margin, safety_margin + 1):
-                    neighbor = (ox + dx, oy + dy)
-                    if neighbor in obstacles:
-                        nearest_type = obstacles[neighbor]
-                        break
-                if nearest_type:
-                    break
-            margin_color = obstacle_types.get(nearest_type, 'pink')
-            margin_rect = plt.Rectangle((ox, oy), 1, 1, color=margin_color, alpha=0.3)
-            ax.add_patch(margin_rect)
-            obstacle_patches.append(margin_rect)
-            if nearest_type in ['Tunnel Wall', 'Low Wall']:
-                edge_color = 'cyan' if nearest_type == 'Tunnel Wall' else 'orange'
-                outline = plt.Rectangle((ox, oy), 1, 1, edgecolor=edge_color, facecolor='none',
-                                        linewidth=1.5, linestyle='--', alpha=0.6)
-                ax.add_patch(outline)
-                obstacle_patches.append(outline)
+    obs_img.set_data(obstacle_rgba())
+    fig.canvas.draw()
+    if getattr(ani, '_blit', False):
+        ani._blit_cache.clear()
 
 def on_click(event):
-    global path, step_index
+    global path, step_index, obstacles_dirty
     if event.inaxes != ax: return
     gx, gy = int(event.xdata), int(event.ydata)
     cell = (gx, gy)
     if event.button == 3:
-        start = tuple(map(int, positions[center_id]))
+        start = tuple(map(int, pos_arr[center_row]))
         path.clear()
-        new_path = a_star(start, cell, obstacles, grid_size)
+        drawn_mask = blocked_mask
+        new_path = a_star(start, cell)
         if new_path:
             path.extend(new_path)
             goal_marker.set_data([cell[0] + 0.5], [cell[1] + 0.5])
             step_index = 0
         else:
             print(f"No valid path to {cell}")
+        # A cache hit returns the mask already on screen; only redraw on a change
+        if blocked_mask is not drawn_mask:
+            obstacles_dirty = True
     elif event.button == 2 or (event.button == 1 and event.key == 'shift'):
-        if cell in obstacles: del obstacles[cell]
-        else: obstacles[cell] = current_obstacle_type
-        draw_obstacles()
+        toggle_obstacle(cell, current_obstacle_type)
 
 def switch_shape(new_shape):
-    global initial_positions, positions, connections, center_id, lines, current_shape_type
+    global initial_positions, connections, center_id, current_shape_type, relative_offsets_arr
+    global id_to_row, pos_arr, conn_idx, center_row
     initial_positions = new_shape['positions']
     connections[:] = new_shape['connections']
     center_id = new_shape['center']
+    relative_offsets_arr = shape_offsets(initial_positions, center_id)
     current_shape_type = new_shape['type']
-    positions.clear()
-    positions.update({k: np.array(v, dtype=float) for k, v in initial_positions.items()})
-    for line in lines: line.remove()
-    lines[:] = [ax.plot([], [], 'k-', linewidth=2)[0] for _ in connections]
+    id_to_row, pos_arr, conn_idx = shape_arrays(initial_positions, connections)
+    center_row = id_to_row[center_id]
 
-def init(): return dots, *lines
+def init(): return dots, line_segments
 
 def animate(frame):
+    global obstacles_dirty
     update_positions()
-    x_vals = [positions[k][0] for k in positions]
-    y_vals = [positions[k][1] for k in positions]
-    dots.set_data(x_vals, y_vals)
-    for i, (a, b) in enumerate(connections):
-        lines[i].set_data([positions[a][0], positions[b][0]], [positions[a][1], positions[b][1]])
-    draw_obstacles()
-    return dots, *lines, *obstacle_patches, goal_marker
+    dots.set_data(pos_arr[:, 0], pos_arr[:, 1])
+    line_segments.set_segments(pos_arr[conn_idx])
+    if obstacles_dirty:
+        draw_obstacles()
+        obstacles_dirty = False
+    return dots, line_segments, goal_marker
 
 fig.canvas.mpl_connect('button_press_event', on_click)
 ani = FuncAnimation(fig, animate, init_func=init, frames=1000, interval=50, blit=True)